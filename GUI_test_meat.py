@@ -1,3 +1,4 @@
+import os
 import tkinter as tk
 import numpy as np
 import pandas as pd
@@ -5,10 +6,13 @@ import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import (FigureCanvasTkAgg, NavigationToolbar2Tk)
 import json
+from collections import OrderedDict
 
 import fair
 from fair.RCPs import rcp3pd, rcp45, rcp6, rcp85
 from CreateToolTip import *
+from food_model import *
+from session import *
 
 
 """
@@ -44,73 +48,82 @@ important widgets of the dashboard:
 
 """
 
-# load the food item data files for these codes
-fii = pd.read_csv('data/food/food_item_info.csv', sep=':')
-len_items = len(fii)
-len_groups = len(np.unique(fii['group']))
-
-index_label = np.unique(fii['group'], return_index=True)[1]
-group_names = [fii['group'][index] for index in sorted(index_label)]
-
-index_id = np.unique(fii['group_id'], return_index=True)[1]
-group_ids = [fii['group_id'][index] for index in sorted(index_id)]
-
 print(len_items, len_groups)
 print(group_names)
 print(group_ids)
 
+# Saved session with control state and cached model results
+# The session is only restored if none of the input files have changed
+session_file = 'dashboard_session.pkl'
+session_inputs = ['data/food/food_supply_data.csv',
+                  'data/food/food_item_info.csv',
+                  'data/food/aaq0216_datas2.xls',
+                  impact_cachefile,
+                  'data/population/Total_population_UN_median_world.npy',
+                  'data/population/Total_population_UN_median_world_projected_2020_2100.npy',
+                  'food_model.py',
+                  'GUI_test_meat.py']
+
+# Processed crop maps are optional, see crop_map.py
+crop_area_file = 'data/land/crop_item_area.npz'
+if os.path.exists(crop_area_file):
+    session_inputs.append(crop_area_file)
+
+# Environmental impact intensity per indicator and item
+# Loaded before hashing the inputs, so an outdated cache file is rebuilt first
+print("Loading impact intensity data ...")
+intensity = impact_intensity()
+
+session_version = input_hash(session_inputs)
+session = load_session(session_file, session_version)
+
+# Maximum number of scenario results kept in cache
+scenario_cache_size = 128
+
+if session is not None:
+    print('Restoring saved session ...')
+    impacts, weight, energy, proteins = session['arrays']
+    scenario_cache = session['scenarios']
+
+else:
+    # Load food data
+    # Pandas data frame with following columns:
+    # Element Code
+    # Element
+    # Item Code
+    # Item
+    # Year
+    # Value
+    print('Loading food data ...')
+    food_data = pd.read_csv('data/food/food_supply_data.csv')
+
+    # Load population data
+    # Two arrays:
+    # - One for estimated population for the 1961-2019 year range
+    # - One for projected population for the 2020-2100 year range
+    print("Loading population data ...")
+    population = np.load("data/population/Total_population_UN_median_world.npy")
+    projected = np.load("data/population/Total_population_UN_median_world_projected_2020_2100.npy")
+
+    # Environmental impacts per indicator, item and year
+    impacts, weight, energy, proteins = food_arrays(food_data, population, projected, intensity)
+    scenario_cache = OrderedDict()
 
-FAOSTAT_years = np.arange(1961, 2020)
-FAOSTAT_projected_years = np.arange(2020, 2101)
-log_length = 25
-
-FAOSTAT_years_all = np.concatenate([FAOSTAT_years, FAOSTAT_projected_years])
-
-# Load food data
-# Pandas data frame with following columns:
-# Element Code
-# Element
-# Item Code
-# Item
-# Year
-# Value
-print('Loading food data ...')
-food_data = pd.read_csv('data/food/food_supply_data.csv')
-
-# Load population data
-# Two arrays:
-# - One for estimated population for the 1961-2019 year range
-# - One for projected population for the 2020-2100 year range
-print("Loading population data ...")
-population = np.load("data/population/Total_population_UN_median_world.npy")
-projected = np.load("data/population/Total_population_UN_median_world_projected_2020_2100.npy")
-
-emissions = np.zeros((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))
 emissions_groups = np.zeros((len_groups, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))
-weight = np.zeros_like(emissions)
-energy = np.zeros_like(emissions)
-proteins = np.zeros_like(emissions)
-
-# Last food supply estimated value is used as pivot value
-# to scale as a function of projected population
-population_pivot = population[-1]
-population_ratio_projected = projected / population_pivot
-
-# First half of the array is filled with estimations from FAOSTAT food supply data
-# Second half of the array is filled with scaled values according to population growth from pivot point
-
-for i, code in enumerate(fii['code']):
-    emissions[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 10004)]['Value'] * 365.25 * fii['mean_emissions'][i] * population / 1e12
-    emissions[i,len(FAOSTAT_years):] = population_ratio_projected * emissions[i,len(FAOSTAT_years)-1]
-
-    weight[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 10004)]['Value']
-    weight[i,len(FAOSTAT_years):] = weight[i,len(FAOSTAT_years)-1]
 
-    energy[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 664)]['Value']
-    energy[i,len(FAOSTAT_years):] = energy[i,len(FAOSTAT_years)-1]
+# Matrix to add item values into food groups
+group_matrix = np.array([fii['group_id'] == id for id in group_ids], dtype=float)
 
-    proteins[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 674)]['Value']
-    proteins[i,len(FAOSTAT_years):] = proteins[i,len(FAOSTAT_years)-1]
+# UK crop area under each food item [km2], from the CEH crop maps
+# Only available if the crop maps have been processed with crop_map.py
+try:
+    with np.load(crop_area_file) as crop_areas:
+        crop_item_area = crop_areas['item_area'].sum(axis=(1, 2)) / 1e6
+        if not np.array_equal(crop_areas['codes'], fii['code']):
+            crop_item_area = None
+except Exception:
+    # Missing or unreadable crop maps only disable the crop area plot
+    crop_item_area = None
 
 glossary_dict = {
     "CO2 concentration":"""Atmospheric CO2 concentration
@@ -131,6 +144,24 @@ glossary_dict = {
     between projected atmospheric temperature
     and baseline expected from stable emissions""",
 
+    "Land use":"""Land used to produce the supplied food,
+    measured in million square kilometers""",
+
+    "Freshwater withdrawals":"""Freshwater withdrawn to produce the
+    supplied food, measured in cubic kilometers""",
+
+    "Eutrophying emissions":"""Emissions causing excess nutrient
+    enrichment of water bodies, measured in
+    million tons of phosphate equivalent""",
+
+    "Acidifying emissions":"""Emissions causing acidification
+    of soils and water bodies, measured in
+    million tons of sulphur dioxide equivalent""",
+
+    "Crop area per food item":"""UK land area under crops producing
+    each food item, from the CEH crop maps,
+    measured in square kilometers""",
+
     "Nutrients":""" Daily protein and energy intake per capita,
     in grams and kCal, respectively""",
 
@@ -180,143 +211,85 @@ vegetarian_diet_dict = {
     or Dairy products and eggs"""
 }
 
-# Function to scale food item consumption to keep protein intake constant
+# Rescaled food supply and climate response for a scenario
+# Results are cached, keeping the most recently used scenarios
 
-# ruminant_slider   [0-4]
-# veg_interv        [0,1]
-# meatfree_slider   [0,7] if veg_interv == 1
-# egg_checkbox      [0,1] if veg_interv == 1
-# dairy_checkbox    [0,1] if veg_interv == 1
-# vegetarian_slider [0,4] if veg_interv == 0
+# scenario  (timescale, nutrient, ruminant, vegetarian_intervention, meatfree,
+#            vegetarian, seafood, eggs, dairy, model)
 
-def timescale_factor(timescale, final_scale, length, start, model = 'linear'):
-    base = np.ones(length)
-    mu = 1 - final_scale
-    if model == 'linear':
-        gradient = np.arange(timescale) / timescale
-        base[start : start + timescale] = 1 - mu*gradient
-        base[start + timescale:] = final_scale
-    elif model == 'logistic':
-        gradient = 1 / (1 + np.exp(-0.5*(log_length + 1 - timescale)*(np.arange(log_length) - timescale / 2)))
-        base[start : start + log_length] = 1 - mu*gradient
-        base[start + log_length:] = final_scale
-    return base
-
-def scale_food(timescale, nutrient, ruminant, vegetarian_intervention, meatfree, vegetarian, seafood, eggs, dairy, model):
-
-    # First scale down ruminant meat consumption.
-    ruminant_fraction = (4-ruminant)/4
-    if model:
-        adoption = 'logistic'
-    else:
-        adoption = 'linear'
-
-    ruminant_fraction = timescale_factor(timescale, ruminant_fraction, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-    meat_fraction = (7-meatfree)/7
-    meat_fraction = timescale_factor(timescale, meat_fraction, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-
-    total_nutrient_seafood = np.sum(nutrient[fii['group_id'] == 10], axis=0)
-    total_nutrient_eggs = np.sum(nutrient[fii['group_id'] == 2], axis=0)
-    total_nutrient_dairy = np.sum(nutrient[fii['group_id'] == 3], axis=0)
-    total_nutrient_pulses = np.sum(nutrient[fii['group_id'] == 5], axis=0)
-    total_nutrient_nuts = np.sum(nutrient[fii['group_id'] == 7], axis=0)
-    total_nutrient_ruminant = np.sum(nutrient[fii['group_id'] == 0], axis=0)
-    total_nutrient_othermeat = np.sum(nutrient[fii['group_id'] == 1], axis=0)
-    total_nutrient = np.sum(nutrient, axis=0)
-
-    total_nutrient_meat = total_nutrient_ruminant + total_nutrient_othermeat
-    total_nutrient_nomeat = total_nutrient - total_nutrient_meat
-    total_nutrient_scaled_ruminant =  total_nutrient_ruminant * ruminant_fraction
-
-    othermeat_fraction = meat_fraction * (total_nutrient_meat - total_nutrient_scaled_ruminant) / total_nutrient_othermeat
-
-    # Meat Free Days
-    if vegetarian_intervention == 0:
-        total_nutrient_scaled_othermeat =  total_nutrient_othermeat * othermeat_fraction
-        total_nutrient_scaled_meat = meat_fraction * (total_nutrient_scaled_othermeat + total_nutrient_scaled_ruminant)
-        total_nutrient_minus_scaled_meat = total_nutrient - total_nutrient_scaled_meat
-        if not seafood:
-            total_nutrient_minus_scaled_meat += (1-meat_fraction) * total_nutrient_seafood
-        if not eggs:
-            total_nutrient_minus_scaled_meat += (1-meat_fraction) * total_nutrient_eggs
-        if not dairy:
-            total_nutrient_minus_scaled_meat += (1-meat_fraction) * total_nutrient_dairy
-
-        nomeat_fraction = total_nutrient_minus_scaled_meat / total_nutrient_nomeat
-
-        ruminant_fraction *= meat_fraction
-        total_nutrient_meat *= meat_fraction
-        food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years))) * nomeat_fraction
-
-        if not seafood:
-            food_scale[fii['group_id'] == 10] *= meat_fraction
-        if not eggs:
-            food_scale[fii['group_id'] == 2] *= meat_fraction
-        if not dairy:
-            food_scale[fii['group_id'] == 3] *= meat_fraction
-
-        food_scale[fii['group_id'] == 0] = ruminant_fraction
-        food_scale[fii['group_id'] == 1] = othermeat_fraction
-
-    # Type of vegetarian diet
-    elif vegetarian_intervention == 1:
-        one_minus_logistic = 1 - timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-        if vegetarian == 0:
-            total_nutrient_scaled_othermeat =  total_nutrient_othermeat * othermeat_fraction
-            total_nutrient_scaled_meat = meat_fraction * (total_nutrient_scaled_othermeat + total_nutrient_scaled_ruminant)
-            total_nutrient_minus_scaled_meat = total_nutrient - total_nutrient_scaled_meat
-            nomeat_fraction = total_nutrient_minus_scaled_meat / total_nutrient_nomeat
-            ruminant_fraction *= meat_fraction
-            total_nutrient_meat *= meat_fraction
-            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years))) * nomeat_fraction
-
-            food_scale[fii['group_id'] == 0] = ruminant_fraction
-            food_scale[fii['group_id'] == 1] = othermeat_fraction
-
-        elif vegetarian == 1:
-            total_vegetarian_nutrient = total_nutrient - total_nutrient_ruminant*one_minus_logistic
-            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
-            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
-            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-
-        elif vegetarian == 2:
-            total_vegetarian_nutrient = total_nutrient - (total_nutrient_ruminant + total_nutrient_othermeat)*one_minus_logistic
-            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
-            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
-            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 1] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 1] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-
-        elif vegetarian == 3:
-            total_vegetarian_nutrient = total_nutrient - (total_nutrient_ruminant + total_nutrient_othermeat + total_nutrient_seafood)*one_minus_logistic
-            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
-            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
-            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 1] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 10] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 1] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 10] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-
-        elif vegetarian == 4:
-            total_vegetarian_nutrient = total_nutrient - (total_nutrient_ruminant + total_nutrient_othermeat + total_nutrient_seafood + total_nutrient_eggs + total_nutrient_dairy)*one_minus_logistic
-            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
-            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
-            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 1] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 10] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 2] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            # food_scale[fii['group_id'] == 3] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
-            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 1] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 10] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 2] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-            food_scale[fii['group_id'] == 3] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
-
-    food_scale[:, :len(FAOSTAT_years)] = 1
-    return food_scale
+def scenario_results(scenario):
+    if scenario in scenario_cache:
+        scenario_cache.move_to_end(scenario)
+        return scenario_cache[scenario]
+
+    timescale, nutrient_name, *interventions = scenario
+
+    # protein supply [g / capita / day] 674
+    # kCal intake [kCal / capita / day] 664
+    # consumed food weight [kg / capita / day] 10004
+
+    if nutrient_name == "Weight":
+        nutrient = weight
+    elif nutrient_name == "Energy":
+        nutrient = energy
+    elif nutrient_name == "Proteins":
+        nutrient = proteins
+
+    # obtain rescaled food supply
+    food_scale = scale_food(timescale, nutrient, *interventions)
+
+    # per capita food supply emissions [kg CO2e / capita / year]
+    # This is computed multiplying the food supply per item (kg/capita/day)
+    # by the global mean specific GHGE per item [kg CO2e / kg], by the country population
+    # and by the number of days on a year
+
+    C, F, T = fair.forward.fair_scm(emissions=np.sum(impacts[0]*food_scale, axis = 0), useMultigas=False)
+
+    scenario_cache[scenario] = food_scale, C, F, T
+    if len(scenario_cache) > scenario_cache_size:
+        scenario_cache.popitem(last=False)
+
+    return scenario_cache[scenario]
+
+# Pinned reference scenario and its results, kept out of the scenario cache
+reference_scenario = None
+reference_results = None
+
+# Candidate minus reference differences for the selected plot
+# Differences are computed from the shared impact and nutrient arrays and the
+# difference in food scaling factors, without running the model again.
+# Returns the labels, values and axis label, or None if the plot has no comparison
+
+def scenario_deltas(plot_key, food_group_value, candidate, reference):
+    food_scale, C, F, T = candidate
+    reference_scale, reference_C, reference_F, reference_T = reference
+    delta_scale = food_scale - reference_scale
+
+    if plot_key == "CO2 emission per food group":
+        return group_names, group_matrix @ (impacts[0]*delta_scale), r"$\Delta$ Fossil $CO_2$ Emissions (GtC)"
+
+    elif plot_key == "CO2 emission per food item":
+        mask = fii['group']==food_group_value
+        return list(fii['name'][mask]), impacts[0][mask]*delta_scale[mask], r"$\Delta$ Fossil $CO_2$ Emissions (GtC)"
+
+    elif plot_key in impact_names:
+        k = impact_names.index(plot_key)
+        return group_names, group_matrix @ (impacts[k]*delta_scale), f"$\\Delta$ {plot_key} ({impact_units[k]})"
+
+    elif plot_key == "Nutrients":
+        relative = [100 * np.sum(nutrient*delta_scale, axis=0) / np.sum(nutrient*reference_scale, axis=0) for nutrient in [energy, proteins]]
+        return ["Energy intake", "Protein intake"], relative, r"$\Delta$ Nutrient intake (%)"
+
+    elif plot_key == "CO2 concentration":
+        return ["CO2 concentration"], [C - reference_C], r"$\Delta$ $CO_2$ concentrations (PPM)"
+
+    elif plot_key == "Radiative forcing":
+        return ["Radiative forcing"], [F - reference_F], r"$\Delta$ Total Radiative Forcing $(W/m^2)$"
+
+    elif plot_key == "Temperature anomaly":
+        return ["Temperature anomaly"], [T - reference_T], r"$\Delta$ Temperature anomaly (K)"
+
+    return None
 
 # Functions to pack and unpack intervention widgets
 def pack_dietary_widgets():
@@ -343,7 +316,7 @@ def pack_policy_widgets():
     button_farming.config(relief='raised')
     button_policy.config(relief='sunken')
 
-def disable_meatfree():
+def disable_meatfree(redraw=True):
     vegetarian_slider.configure(state='normal', fg='black')
     vegetarian_label.configure(fg='black')
     lbl_vegetarian_glossary.grid(row = 9, column = 0, columnspan=4, sticky='W')
@@ -353,9 +326,10 @@ def disable_meatfree():
     seafood_checkbox.configure(state='disabled')
     egg_checkbox.configure(state='disabled')
     dairy_checkbox.configure(state='disabled')
-    plot()
+    if redraw:
+        plot()
 
-def disable_vegetarian():
+def disable_vegetarian(redraw=True):
     meatfree_slider.configure(state='normal', fg='black')
     meatfree_label.configure(fg='black')
     seafood_checkbox.configure(state='normal')
@@ -365,15 +339,66 @@ def disable_vegetarian():
     vegetarian_slider.configure(state='disabled', fg='gray')
     vegetarian_label.configure(fg='gray')
     lbl_vegetarian_glossary.grid_forget()
+    if redraw:
+        plot()
+
+# Functions to pin a reference scenario and compare against it
+def pin_scenario():
+    global reference_scenario, reference_results
+    reference_scenario = current_scenario()
+    reference_results = scenario_results(reference_scenario)
+    compare_choice.set(True)
     plot()
 
-# function to generate the plots in tkinter canvas
-def plot():
-
-    # Read the selection and generate the arrays
-    plot_key = plot_option.get()
-    food_group_value = food_group_option.get()
-
+def toggle_comparison():
+    if compare_choice.get() and reference_scenario is None:
+        pin_scenario()
+    else:
+        plot()
+
+# Place the plot on the full canvas, or on the top pane over the comparison pane
+def layout_panes(compare):
+    plot1.set_position(top_pane if compare else full_pane)
+    plot2.set_position(top_pane if compare else full_pane)
+    plot3.set_visible(compare)
+
+# Functions to store and restore the session on exit and launch
+def current_controls():
+    return {name: control.get() for name, control in session_controls.items()}
+
+def save_and_quit():
+    controls = current_controls()
+    try:
+        save_session(session_file, session_version, controls=controls,
+                     arrays=(impacts, weight, energy, proteins), scenarios=scenario_cache,
+                     reference=(reference_scenario, reference_results))
+    except Exception as error:
+        # The window is always closed, even if the session can not be saved
+        print(f'Could not save session to {session_file}: {error}')
+    finally:
+        window.destroy()
+
+def restore_controls(controls):
+    # Plots which are no longer available, like the crop areas, fall back to the default plot
+    if controls['plot_option'] not in option_list:
+        controls = dict(controls, plot_option=default_plot)
+    # Vegetarian diet widgets are disabled by default, and disabled sliders ignore new values
+    if controls['veg_interv'] == 1:
+        disable_meatfree(redraw=False)
+    for name, value in controls.items():
+        session_controls[name].set(value)
+
+# Controls shown in the last plot
+plotted_controls = None
+
+# Scales also invoke their command after being set from code, e.g. when restoring
+# the session, so sliders only redraw if a control changed since the last plot
+def slider_changed(_):
+    if current_controls() != plotted_controls:
+        plot()
+
+# Scenario selected by the intervention controls
+def current_scenario():
     timescale = timescale_slider.get()
     ruminant = ruminant_slider.get()
     vegetarian_intervention = veg_interv.get()
@@ -382,9 +407,20 @@ def plot():
     egg = egg_choice.get()
     dairy = dairy_choice.get()
     vegetarian = vegetarian_slider.get()
-    year = year_choice.get()
     model = model_choice.get()
 
+    return (timescale, scaling_nutrient.get(), ruminant, vegetarian_intervention, meatfree, vegetarian, seafood, egg, dairy, model)
+
+# function to generate the plots in tkinter canvas
+def plot():
+    global plotted_controls
+    plotted_controls = current_controls()
+
+    # Read the selection and generate the arrays
+    plot_key = plot_option.get()
+    food_group_value = food_group_option.get()
+    year = year_choice.get()
+
     if year:
         years = FAOSTAT_years_all
     else:
@@ -401,34 +437,19 @@ def plot():
     plot1.clear()
     plot2.clear()
     plot2.axis("off")
+    plot3.clear()
 
-    # protein supply [g / capita / day] 674
-    # kCal intake [kCal / capita / day] 664
-    # consumed food weight [kg / capita / day] 10004
-
-    if scaling_nutrient.get() == "Weight":
-        nutrient = weight
-    elif scaling_nutrient.get() == "Energy":
-        nutrient = energy
-    elif scaling_nutrient.get() == "Proteins":
-        nutrient = proteins
-
-    # obtain rescaled food supply
-    food_scale = scale_food(timescale, nutrient, ruminant, vegetarian_intervention, meatfree, vegetarian, seafood, egg, dairy, model)
+    # obtain rescaled food supply and climate response
+    food_scale, C, F, T = scenario_results(current_scenario())
 
-    scaled_emissions = emissions*food_scale
+    scaled_impacts = impacts*food_scale
+    scaled_emissions = scaled_impacts[0]
     scaled_energy = energy*food_scale
     scaled_proteins = proteins*food_scale
 
-    # per capita food supply emissions [kg CO2e / capita / year]
-    # This is computed multiplying the food supply per item (kg/capita/day)
-    # by the global mean specific GHGE per item [kg CO2e / kg], by the country population
-    # and by the number of days on a year
-
-    # category_emissions = np.zeros((len_categories, len(FAOSTAT_years)))
-    C, F, T = fair.forward.fair_scm(emissions=np.sum(scaled_emissions, axis = 0), useMultigas=False)
-
-    plot1.axvline(2020, color = 'k', alpha = 0.5, linestyle = 'dashed')
+    if plot_key != "Crop area per food item":
+        plot1.axvline(2020, color = 'k', alpha = 0.5, linestyle = 'dashed')
+        plot1.set_xlabel("Year")
 
     if plot_key == "CO2 concentration":
         plot1.plot(years, C[:len(years)], c = 'k')
@@ -463,6 +484,18 @@ def plot():
         # plot1.set_ylim((-1,40))
         plot1.set_ylabel(r"Fossil $CO_2$ Emissions (GtC)")
 
+    elif plot_key in impact_names:
+
+        impact_groups = group_matrix @ scaled_impacts[impact_names.index(plot_key)]
+        impact_cumsum_group = np.cumsum(impact_groups, axis=0)
+
+        for i in reversed(range(len_groups)):
+            plot1.fill_between(years, impact_cumsum_group[i][:len(years)], label = group_names[i], alpha=0.5)
+            plot1.plot(years, impact_cumsum_group[i][:len(years)], color = 'k', linewidth=0.5)
+
+        plot1.legend(loc=2, fontsize=7)
+        plot1.set_ylabel(f"{plot_key} ({impact_units[impact_names.index(plot_key)]})")
+
     elif plot_key == "Nutrients":
 
         plot2.axis("on")
@@ -485,7 +518,29 @@ def plot():
         plot1.set_ylim((0,5))
         plot1.set_ylabel(r"Temperature anomaly (K)")
 
-    plot1.set_xlabel("Year")
+    elif plot_key == "Crop area per food item":
+        mask = crop_item_area > 0
+        plot1.barh(fii['name'][mask], crop_item_area[mask], color = 'green', alpha=0.5)
+        plot1.tick_params(axis='y', labelsize=7)
+        plot1.set_xlabel(r"Crop area $(km^2)$")
+
+    # Difference with the pinned scenario, drawn on the comparison pane
+    deltas = None
+    if compare_choice.get() and reference_results is not None:
+        deltas = scenario_deltas(plot_key, food_group_value, (food_scale, C, F, T), reference_results)
+    layout_panes(deltas is not None)
+
+    if deltas is not None:
+        labels, values, ylabel = deltas
+        plot3.axvline(2020, color = 'k', alpha = 0.5, linestyle = 'dashed')
+        plot3.axhline(0, color = 'k', linewidth=0.5)
+        for label, value in zip(labels, values):
+            plot3.plot(years, value[:len(years)], label = label)
+        plot3.legend(loc=2, fontsize=6, ncol=2)
+        plot3.set_title("Difference with pinned scenario", fontsize=9)
+        plot3.set_ylabel(ylabel)
+        plot3.set_xlabel("Year")
+
     canvas.draw()
 
     lbl_glossary.config(text=glossary_dict[plot_key], font=("Courier", 12))
@@ -561,7 +616,7 @@ for ic, label in enumerate(['Weight', 'Proteins', 'Energy']):
 
 
 ruminant_label = tk.Label(master = frame_diet, text="Reduce ruminant meat consumption", font=("Courier", 12))
-ruminant_slider = tk.Scale(master = frame_diet, from_=0, to=4, orient=tk.HORIZONTAL, command= lambda _: plot())
+ruminant_slider = tk.Scale(master = frame_diet, from_=0, to=4, orient=tk.HORIZONTAL, command = slider_changed)
 CreateToolTip(ruminant_slider, \
 '0: 0% ruminant meat reduction \n'
 '1: 25% ruminant meat reduction \n'
@@ -577,7 +632,7 @@ CreateToolTip(meatfree_rdbtn, \
 'is replaced by an increase consumption '
 'of selected items to supply replacement nutrients.')
 meatfree_label = tk.Label(master = frame_diet, text="Number of meat-free days", font=("Courier", 12))
-meatfree_slider = tk.Scale(master = frame_diet, from_=0, to=7, orient=tk.HORIZONTAL, command= lambda _: plot())
+meatfree_slider = tk.Scale(master = frame_diet, from_=0, to=7, orient=tk.HORIZONTAL, command = slider_changed)
 CreateToolTip(meatfree_slider, \
 'Choose the number of days a week '
 'with no meat consumption')
@@ -610,7 +665,7 @@ CreateToolTip(vegetarian_rdbtn, \
 'an increase consumption of selected items '
 'to supply replacement nutrients.')
 vegetarian_label = tk.Label(master = frame_diet, text="Vegetarian diet", font=("Courier", 12), fg='gray')
-vegetarian_slider = tk.Scale(master = frame_diet, from_=0, to=4, orient=tk.HORIZONTAL, command= lambda _: plot(), state='disabled', fg='gray')
+vegetarian_slider = tk.Scale(master = frame_diet, from_=0, to=4, orient=tk.HORIZONTAL, command = slider_changed, state='disabled', fg='gray')
 CreateToolTip(vegetarian_slider, \
 '0: Omnivorous diet \n'
 '1: Semi-vegetarian diet \n'
@@ -663,8 +718,11 @@ frame_policy = tk.Frame(master = frame_controls)
 # -----------------------------------------
 
 # Plot option dropdown menu
-option_list = ["CO2 emission per food group", "CO2 emission per food item", "CO2 concentration", "Radiative forcing", "Temperature anomaly", "Nutrients"]
-plot_option = tk.StringVar(value="CO2 emission per food group")
+option_list = ["CO2 emission per food group", "CO2 emission per food item", "CO2 concentration", "Radiative forcing", "Temperature anomaly", "Nutrients"] + impact_names[1:]
+if crop_item_area is not None:
+    option_list.append("Crop area per food item")
+default_plot = "CO2 emission per food group"
+plot_option = tk.StringVar(value=default_plot)
 opt_plot = tk.OptionMenu(frame_plots, plot_option, *option_list, command = lambda _: plot())
 opt_plot.config(font=("Courier", 12))
 opt_plot.pack()
@@ -686,16 +744,37 @@ CreateToolTip(model_checkbox,
 'Use a logistic model instead of a linear model for interention adoption timescale')
 model_checkbox.pack()
 
-timescale_slider = tk.Scale(master = frame_plots, from_=1, to=log_length, orient=tk.HORIZONTAL, command= lambda _: plot())
+timescale_slider = tk.Scale(master = frame_plots, from_=1, to=log_length, orient=tk.HORIZONTAL, command = slider_changed)
 CreateToolTip(timescale_slider, \
 'Select the timescale in years over which the transformation '
 'takes place. 0 means the transformation occurs instantly.')
 timescale_slider.pack()
 
+# Scenario comparison options
+compare_choice = tk.BooleanVar()
+compare_choice.set(False)
+compare_checkbox = tk.Checkbutton(master = frame_plots, text = 'Compare with pinned scenario', offvalue = False, onvalue = True, variable = compare_choice, command = toggle_comparison)
+CreateToolTip(compare_checkbox,
+'Show the difference between the current scenario '
+'and the pinned reference scenario below the plot.')
+compare_checkbox.pack()
+
+pin_button = tk.Button(master = frame_plots, text = "Pin current scenario", command = pin_scenario, font=("Courier", 12))
+CreateToolTip(pin_button,
+'Use the current selection of interventions '
+'as reference scenario for comparisons.')
+pin_button.pack()
+
 # Figure widget
 fig, plot1 = plt.subplots(figsize = (5,8))
 plot2 = plot1.twinx()
 
+# Comparison pane, shown below the plot when comparing with a pinned scenario
+full_pane = plot1.get_position()
+top_pane = [full_pane.x0, full_pane.y0 + 0.45*full_pane.height, full_pane.width, 0.55*full_pane.height]
+plot3 = fig.add_axes([full_pane.x0, full_pane.y0, full_pane.width, 0.33*full_pane.height])
+plot3.set_visible(False)
+
 fig.patch.set_facecolor('#D9D9D9')
 
 canvas = FigureCanvasTkAgg(fig, master = frame_plots)
@@ -714,8 +793,31 @@ food_group_menu.pack()
 
 ################# Setup #################
 
+# Controls saved with the session
+session_controls = {
+    'plot_option':plot_option,
+    'food_group_option':food_group_option,
+    'year_choice':year_choice,
+    'model_choice':model_choice,
+    'timescale':timescale_slider,
+    'scaling_nutrient':scaling_nutrient,
+    'ruminant':ruminant_slider,
+    'veg_interv':veg_interv,
+    'meatfree':meatfree_slider,
+    'seafood':seafood_choice,
+    'egg':egg_choice,
+    'dairy':dairy_choice,
+    'vegetarian':vegetarian_slider,
+    'compare':compare_choice,
+}
+
 pack_dietary_widgets()
+if session is not None:
+    reference_scenario, reference_results = session['reference']
+    restore_controls(session['controls'])
 plot()
 
+window.protocol("WM_DELETE_WINDOW", save_and_quit)
+
 ################ Loop ###################
 window.mainloop()
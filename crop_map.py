@@ -0,0 +1,228 @@
+import sys
+
+import numpy as np
+import shapely
+
+from food_model import *
+
+
+"""
+FixOurFood crop area maps
+
+Converts the UK CEH Land Cover Plus crop maps into area weighted grid maps,
+and links the crop areas to the food items in food_item_info.csv so the
+dashboard can report the land area under each food item.
+
+Reading_CEH_data.ipynb places a single HEALPix pixel at the centroid of each
+crop parcel, which loses the parcel area and requires per parcel geometry
+operations. Here the whole crop layer is rasterized at once into a regular
+grid in the projected coordinates of the layer (British National Grid, in
+meters), which allows computing the exact area of every parcel falling
+into each cell:
+
+- The coordinates of all polygon rings are extracted as bulk arrays.
+- Every ring edge is split where it crosses the grid lines.
+- The signed area between each edge piece and the bottom of its cell, and
+  the full cell heights below it, are accumulated per crop and cell with
+  np.bincount, as in the shoelace formula for polygon areas.
+
+Polygons are processed in chunks to limit memory use, but there is no Python
+loop over polygons, edges or cells.
+
+Crop maps can be obtained from Digimap, see Reading_CEH_data.ipynb.
+Usage:
+
+    python crop_map.py crop_file [cell size in meters]
+
+which writes the per item areas read by the dashboard to item_area_file.
+
+"""
+
+item_area_file = 'data/land/crop_item_area.npz'
+
+# FAO item codes of the food items produced by each CEH crop type.
+# Crops without a food item in food_item_info.csv, like grass and sugar beet,
+# are reported as unmapped.
+crop_item_codes = {
+    'winter wheat':2511,
+    'spring wheat':2511,
+    'winter barley':2513,
+    'spring barley':2513,
+    'maize':2514,
+    'winter oats':2516,
+    'spring oats':2516,
+    'potatoes':2531,
+    'field beans':2546,
+    'winter field beans':2546,
+    'spring field beans':2546,
+    'oilseed rape':2558,
+    'winter oilseed rape':2558,
+    'spring oilseed rape':2558,
+}
+
+def crop_grid(bounds, cell_size):
+    """
+    Returns the origin and shape (x0, y0, nx, ny) of a grid of square cells
+    of cell_size covering bounds (xmin, ymin, xmax, ymax), aligned to multiples of cell_size
+    """
+    xmin, ymin, xmax, ymax = bounds
+    x0 = np.floor(xmin / cell_size) * cell_size
+    y0 = np.floor(ymin / cell_size) * cell_size
+    nx = int(np.ceil((xmax - x0) / cell_size))
+    ny = int(np.ceil((ymax - y0) / cell_size))
+    return x0, y0, nx, ny
+
+def _ragged_arange(counts):
+    # Concatenation of np.arange(count) for each count
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.arange(np.sum(counts)) - offsets
+
+def _edges(geometries):
+    # Edges of all polygon rings in geometries, with the geometry index and
+    # a +1 or -1 sign orienting exterior rings counterclockwise and holes clockwise
+    parts, part_geometry = shapely.get_parts(geometries, return_index=True)
+    rings, ring_part = shapely.get_rings(parts, return_index=True)
+    exterior = np.r_[True, ring_part[1:] != ring_part[:-1]]
+
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    same_ring = coord_ring[1:] == coord_ring[:-1]
+    start, end, edge_ring = coords[:-1][same_ring], coords[1:][same_ring], coord_ring[:-1][same_ring]
+
+    ring_area = -np.bincount(edge_ring, weights=(end[:,0] - start[:,0])*(end[:,1] + start[:,1])/2, minlength=len(rings))
+    ring_sign = np.where(exterior, 1, -1) * np.sign(ring_area)
+
+    return start, end, part_geometry[ring_part[edge_ring]], ring_sign[edge_ring]
+
+def rasterize(geometries, classes, n_classes, grid, cell_size, chunk_size=100000):
+    """
+    Area of the polygons in geometries falling in each cell of grid, for each class.
+
+    geometries  array of polygons or multipolygons
+    classes     class index of each geometry, in the [0, n_classes) range
+    grid        (x0, y0, nx, ny) as returned by crop_grid
+
+    Returns an array with shape (n_classes, ny, nx) with the areas in squared
+    coordinate units, with the first row at the bottom of the grid.
+    """
+    x0, y0, nx, ny = grid
+    classes = np.asarray(classes)
+
+    # Partial cell areas, and full cell heights to be added to all cells below,
+    # using an extra row on top for polygons extending beyond the grid
+    partial = np.zeros(n_classes * nx * (ny + 1))
+    cover = np.zeros(n_classes * nx * (ny + 1))
+
+    for first in range(0, len(geometries), chunk_size):
+        start, end, geometry, sign = _edges(geometries[first:first + chunk_size])
+        edge_class = classes[first:first + chunk_size][geometry]
+
+        # Coordinates in cell units
+        u0, v0 = (start[:,0] - x0) / cell_size, (start[:,1] - y0) / cell_size
+        u1, v1 = (end[:,0] - x0) / cell_size, (end[:,1] - y0) / cell_size
+
+        # Split edges at every vertical and horizontal grid line crossing
+        u_low, u_high = np.floor(np.minimum(u0, u1)), np.floor(np.maximum(u0, u1))
+        v_low, v_high = np.floor(np.minimum(v0, v1)), np.floor(np.maximum(v0, v1))
+        u_crossings = (u_high - u_low).astype(int)
+        v_crossings = (v_high - v_low).astype(int)
+
+        edge = np.arange(len(u0))
+        u_edge = np.repeat(edge, u_crossings)
+        v_edge = np.repeat(edge, v_crossings)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            u_t = (u_low[u_edge] + 1 + _ragged_arange(u_crossings) - u0[u_edge]) / (u1 - u0)[u_edge]
+            v_t = (v_low[v_edge] + 1 + _ragged_arange(v_crossings) - v0[v_edge]) / (v1 - v0)[v_edge]
+
+        t = np.concatenate([np.zeros(len(edge)), u_t, v_t, np.ones(len(edge))])
+        t_edge = np.concatenate([edge, u_edge, v_edge, edge])
+        order = np.lexsort((t, t_edge))
+        t, t_edge = t[order], t_edge[order]
+
+        # Pieces between consecutive split points of the same edge
+        piece = t_edge[1:] == t_edge[:-1]
+        t_start, t_end, piece_edge = t[:-1][piece], t[1:][piece], t_edge[:-1][piece]
+
+        du, dv = (u1 - u0)[piece_edge], (v1 - v0)[piece_edge]
+        pu0, pu1 = u0[piece_edge] + t_start*du, u0[piece_edge] + t_end*du
+        pv0, pv1 = v0[piece_edge] + t_start*dv, v0[piece_edge] + t_end*dv
+
+        i = np.floor((pu0 + pu1) / 2).astype(int)
+        j = np.floor((pv0 + pv1) / 2).astype(int)
+        width = -(pu1 - pu0) * sign[piece_edge]
+        height = (pv0 + pv1) / 2 - j
+
+        # Pieces outside the grid columns or below the grid do not cover any cell
+        inside = (i >= 0) & (i < nx) & (j >= 0)
+        j = np.minimum(j, ny)
+        index = (edge_class[piece_edge]*nx + i)*(ny + 1) + j
+        inside_top = inside & (j < ny)
+
+        partial += np.bincount(index[inside_top], weights=(width*height)[inside_top], minlength=len(partial))
+        cover += np.bincount(index[inside], weights=width[inside], minlength=len(cover))
+
+    partial = partial.reshape(n_classes, nx, ny + 1)
+    cover = cover.reshape(n_classes, nx, ny + 1)
+
+    # Each cell is fully covered by the pieces on the cells above it
+    above = np.cumsum(cover[:, :, ::-1], axis=2)[:, :, ::-1]
+    area = partial[:, :, :ny] + above[:, :, 1:]
+
+    return np.transpose(area, (0, 2, 1)) * cell_size**2
+
+def item_areas(crop_area, crop_names):
+    """
+    Adds up the crop areas into food items.
+
+    crop_area   array with shape (crop, ...) with the area of each crop
+    crop_names  names of the crops in crop_area
+
+    Returns the areas with shape (item, ...), in the food_item_info.csv order,
+    and the area of the crops not producing any of the food items.
+    """
+    mapping = np.zeros((len_items, len(crop_names)))
+    for c, name in enumerate(crop_names):
+        code = crop_item_codes.get(name.strip().lower())
+        if code is not None:
+            mapping[fii['code'] == code, c] = 1
+
+    crop_area = np.asarray(crop_area)
+    flat = crop_area.reshape(len(crop_names), -1)
+    item_area = (mapping @ flat).reshape((len_items,) + crop_area.shape[1:])
+    unmapped = ((1 - mapping.sum(axis=0)) @ flat).reshape(crop_area.shape[1:])
+
+    return item_area, unmapped
+
+def crop_item_maps(crops, cell_size=1000, crop_column='crop_name', chunk_size=100000):
+    """
+    Rasterizes a CEH crop layer (GeoDataFrame in a projected, meters based CRS)
+    into area weighted grid maps per food item.
+    Returns the item maps with shape (item, ny, nx) in squared meters,
+    the map of unmapped crop areas, the crop names and per crop maps, and the grid.
+    """
+    crop_names, classes = np.unique(np.asarray(crops[crop_column], dtype=str), return_inverse=True)
+    grid = crop_grid(crops.total_bounds, cell_size)
+    crop_area = rasterize(np.asarray(crops.geometry.values), classes, len(crop_names), grid, cell_size, chunk_size)
+    item_area, unmapped = item_areas(crop_area, crop_names)
+    return item_area, unmapped, crop_names, crop_area, grid
+
+if __name__ == '__main__':
+    import os
+    import geopandas as gpd
+
+    crop_file = sys.argv[1]
+    cell_size = float(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    print('Loading crop data ...')
+    crops = gpd.read_file(crop_file)
+
+    print('Rasterizing crop areas ...')
+    item_area, unmapped, crop_names, crop_area, grid = crop_item_maps(crops, cell_size)
+
+    os.makedirs(os.path.dirname(item_area_file), exist_ok=True)
+    np.savez_compressed(item_area_file, codes=fii['code'], item_area=item_area, unmapped=unmapped,
+                        crop_names=crop_names, crop_area=crop_area, grid=grid, cell_size=cell_size)
+
+    for name, area in zip(fii['name'], item_area.sum(axis=(1, 2))):
+        if area > 0:
+            print(f'{name:<30}{area/1e6:>12.1f} km2')
+    print(f'{"Unmapped crops":<30}{unmapped.sum()/1e6:>12.1f} km2')
@@ -0,0 +1,288 @@
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import fair
+from food_model import *
+from session import input_hash
+
+
+"""
+Golden-output equivalence harness
+
+Records reference outputs of the current dashboard model over a large sampled
+set of control combinations, and checks alternative engines (vectorized,
+float32, emulated, cached, ...) against them before they are swapped in.
+
+An engine is any function engine(arrays, scenario) returning a dictionary
+with the quantities below, where arrays is the dictionary returned by
+dashboard_arrays and scenario is a tuple with the same order as the
+dashboard scenario cache:
+
+    (timescale, nutrient, ruminant, vegetarian_intervention, meatfree,
+     vegetarian, seafood, eggs, dairy, model)
+
+Quantities:
+
+- food_scale        (item, year) food supply scaling factors from scale_food
+- emissions_groups  (group, year) GHG emissions per food group [Gt CO2e]
+- energy            (year) energy supply [kCal / capita / day]
+- proteins          (year) protein supply [g / capita / day]
+- C, F, T           (year) FAIR concentration, forcing and temperature anomaly
+
+model_engine builds engines by swapping the scale_food and climate functions
+or the floating point type, and reference_engine is the current model.
+
+Besides the per quantity tolerances, compare runs two property checks:
+
+- Historical years are never rescaled.
+- The chosen nutrient total is conserved after substitution, wherever the
+  reference engine conserves it. Meat-free days and vegetarian diets 1-4
+  normalise nutrient totals differently and do not conserve them exactly,
+  so the candidate is only required not to deviate more than the reference.
+
+Usage:
+
+    python equivalence.py record [number of scenarios]
+    python equivalence.py check
+    python equivalence.py inputs
+
+The hash of the input files used for a recording is kept apart from the
+outputs, in golden_inputs_file. After an input change which leaves the
+outputs unchanged, "inputs" updates this hash once the reference engine
+passes the check, without writing a new outputs file.
+
+"""
+
+golden_file = 'data/golden/reference_outputs.npz'
+golden_inputs_file = 'data/golden/reference_inputs.txt'
+
+nutrient_names = ['Weight', 'Energy', 'Proteins']
+quantities = ['food_scale', 'emissions_groups', 'energy', 'proteins', 'C', 'F', 'T']
+
+# Relative and absolute tolerance for each quantity
+default_tolerances = {
+    'food_scale':(1e-9, 1e-12),
+    'emissions_groups':(1e-9, 1e-12),
+    'energy':(1e-9, 1e-9),
+    'proteins':(1e-9, 1e-9),
+    'C':(1e-9, 1e-9),
+    'F':(1e-9, 1e-9),
+    'T':(1e-9, 1e-9),
+}
+
+# Dashboard input files, used to check the recording was made with the same data
+input_files = ['data/food/food_supply_data.csv',
+               'data/food/food_item_info.csv',
+               'data/food/aaq0216_datas2.xls',
+               impact_cachefile,
+               'data/population/Total_population_UN_median_world.npy',
+               'data/population/Total_population_UN_median_world_projected_2020_2100.npy']
+
+def dashboard_arrays():
+    """
+    Returns the same model arrays used by the dashboard
+    """
+    food_data = pd.read_csv('data/food/food_supply_data.csv')
+    population = np.load("data/population/Total_population_UN_median_world.npy")
+    projected = np.load("data/population/Total_population_UN_median_world_projected_2020_2100.npy")
+    impacts, weight, energy, proteins = food_arrays(food_data, population, projected, impact_intensity())
+
+    return {
+        'impacts':impacts,
+        'Weight':weight,
+        'Energy':energy,
+        'Proteins':proteins,
+        'group_matrix':np.array([fii['group_id'] == id for id in group_ids], dtype=float),
+    }
+
+def fair_climate(emissions):
+    C, F, T = fair.forward.fair_scm(emissions=emissions, useMultigas=False)
+    return C, F, T
+
+def model_engine(scale_food=scale_food, climate=fair_climate, dtype=float):
+    """
+    Builds an engine from a scale_food and a climate function.
+    Arrays are cast to dtype before being passed to scale_food, and its result is
+    cast to dtype before computing the outputs. The default scale_food allocates its
+    own float64 arrays, so a fully float32 engine also needs a float32 scale_food.
+    """
+    # Arrays cast for the last arrays dictionary, which is kept to compare by identity
+    cast = {'arrays':None, 'typed':None}
+
+    def engine(arrays, scenario):
+        if cast['arrays'] is not arrays:
+            cast['arrays'] = arrays
+            cast['typed'] = {key:np.asarray(value, dtype=dtype) for key, value in arrays.items()}
+        typed = cast['typed']
+
+        timescale, nutrient_name, *interventions = scenario
+        food_scale = np.asarray(scale_food(timescale, typed[nutrient_name], *interventions), dtype=dtype)
+
+        emissions = typed['impacts'][0]*food_scale
+        C, F, T = climate(np.sum(emissions, axis=0))
+
+        return {
+            'food_scale':food_scale,
+            'emissions_groups':typed['group_matrix'] @ emissions,
+            'energy':np.sum(typed['Energy']*food_scale, axis=0),
+            'proteins':np.sum(typed['Proteins']*food_scale, axis=0),
+            'C':C, 'F':F, 'T':T,
+        }
+
+    return engine
+
+reference_engine = model_engine()
+
+def sample_scenarios(n, seed=0):
+    """
+    Random control combinations allowed by the dashboard widgets.
+    The startup scenario is always included first.
+    """
+    rng = np.random.default_rng(seed)
+    scenarios = [(1, 'Weight', 0, 0, 0, 0, True, True, True, True)]
+
+    while len(scenarios) < n:
+        vegetarian_intervention = int(rng.integers(0, 2))
+        scenarios.append((
+            int(rng.integers(1, log_length + 1)),
+            nutrient_names[rng.integers(0, len(nutrient_names))],
+            int(rng.integers(0, 5)),
+            vegetarian_intervention,
+            int(rng.integers(0, 8)) if vegetarian_intervention == 0 else 0,
+            int(rng.integers(0, 5)) if vegetarian_intervention == 1 else 0,
+            *(bool(choice) for choice in rng.integers(0, 2, 4)),
+        ))
+
+    return scenarios
+
+def _encode(scenarios):
+    return np.array([[value if i != 1 else nutrient_names.index(value) for i, value in enumerate(scenario)]
+                     for scenario in scenarios], dtype=int)
+
+def _decode(encoded):
+    return [(int(s[0]), nutrient_names[s[1]], int(s[2]), int(s[3]), int(s[4]), int(s[5]),
+             bool(s[6]), bool(s[7]), bool(s[8]), bool(s[9])) for s in encoded]
+
+def run_engine(engine, arrays, scenarios):
+    """
+    Runs engine over scenarios, returning the stacked outputs for each
+    quantity and the mean time per scenario in seconds.
+    """
+    outputs = {quantity:[] for quantity in quantities}
+    start = time.perf_counter()
+    for scenario in scenarios:
+        result = engine(arrays, scenario)
+        for quantity in quantities:
+            outputs[quantity].append(result[quantity])
+    elapsed = (time.perf_counter() - start) / len(scenarios)
+
+    return {quantity:np.array(values, dtype=float) for quantity, values in outputs.items()}, elapsed
+
+def record(n=500, seed=0, path=golden_file):
+    """
+    Records reference_engine outputs for n sampled scenarios into path
+    """
+    arrays = dashboard_arrays()
+    scenarios = sample_scenarios(n, seed)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        outputs, elapsed = run_engine(reference_engine, arrays, scenarios)
+
+    np.savez_compressed(path, scenarios=_encode(scenarios), **outputs)
+    record_inputs()
+    print(f'Recorded {n} scenarios in {path} ({1e3*elapsed:.2f} ms per scenario)')
+
+def record_inputs(path=golden_inputs_file):
+    """
+    Stores the hash of the current input files in path
+    """
+    with open(path, 'w') as f:
+        f.write(input_hash(input_files) + '\n')
+
+def recorded_inputs(path=golden_inputs_file):
+    """
+    Returns the input hash stored in path, or None if there is none
+    """
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def _nutrient_deviation(arrays, scenarios, food_scale):
+    deviation = np.zeros(len(scenarios))
+    for i, scenario in enumerate(scenarios):
+        nutrient = arrays[scenario[1]]
+        total = np.sum(nutrient, axis=0)
+        deviation[i] = np.max(np.abs(np.sum(nutrient*food_scale[i], axis=0) / total - 1))
+    return deviation
+
+def compare(engine, tolerances=None, path=golden_file):
+    """
+    Checks engine against the recorded reference outputs, printing the errors,
+    timings and property checks side by side.
+    Returns True if every quantity is within tolerance and every property holds.
+    """
+    tolerances = dict(default_tolerances, **(tolerances or {}))
+    golden = np.load(path)
+    if recorded_inputs() != input_hash(input_files):
+        print(f'Warning: {path} was recorded with different input data')
+
+    arrays = dashboard_arrays()
+    scenarios = _decode(golden['scenarios'])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        reference, reference_time = run_engine(reference_engine, arrays, scenarios)
+        candidate, candidate_time = run_engine(engine, arrays, scenarios)
+
+    passed = True
+    print(f'{"quantity":<18}{"max abs err":>14}{"max rel err":>14}{"rtol":>10}{"atol":>10}  result')
+    for quantity in quantities:
+        expected, actual = golden[quantity], candidate[quantity]
+        rtol, atol = tolerances[quantity]
+        if actual.shape != expected.shape:
+            passed = False
+            print(f'{quantity:<18}{"shape " + str(actual.shape) + " != " + str(expected.shape):>48}  FAIL')
+            continue
+        error = np.abs(actual - expected)
+        relative = error / np.maximum(np.abs(expected), np.finfo(float).tiny)
+        ok = np.allclose(actual, expected, rtol=rtol, atol=atol, equal_nan=True)
+        passed &= ok
+        print(f'{quantity:<18}{np.nanmax(error):>14.3e}{np.nanmax(relative):>14.3e}{rtol:>10.0e}{atol:>10.0e}  {"PASS" if ok else "FAIL"}')
+
+    # Property checks, which need food_scale with the reference shape
+    if candidate['food_scale'].shape != golden['food_scale'].shape:
+        passed = False
+        print(f'{"property checks":<46}  FAIL (food_scale shape '
+              f'{candidate["food_scale"].shape} != {golden["food_scale"].shape})')
+    else:
+        historical = np.all(candidate['food_scale'][:, :, :len(FAOSTAT_years)] == 1)
+        print(f'{"historical years unscaled":<46}  {"PASS" if historical else "FAIL"}')
+
+        reference_deviation = _nutrient_deviation(arrays, scenarios, golden['food_scale'])
+        candidate_deviation = _nutrient_deviation(arrays, scenarios, candidate['food_scale'])
+        conserved = reference_deviation < 1e-9
+        # Deviations are allowed up to the food_scale relative tolerance
+        violations = np.sum(candidate_deviation > reference_deviation + tolerances['food_scale'][0])
+        print(f'{"nutrient total conserved":<46}  {"PASS" if violations == 0 else "FAIL"} '
+              f'({np.sum(conserved)} of {len(scenarios)} scenarios conserved by reference, {violations} violations)')
+        passed &= historical and violations == 0
+
+    print(f'reference {1e3*reference_time:.2f} ms, candidate {1e3*candidate_time:.2f} ms per scenario '
+          f'(speedup {reference_time / candidate_time:.2f}x)')
+
+    return bool(passed)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        record(*[int(arg) for arg in sys.argv[2:3]])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'inputs':
+        if not compare(reference_engine):
+            print('Reference outputs differ, record them again instead')
+            sys.exit(1)
+        record_inputs()
+        print(f'Updated input hash in {golden_inputs_file}')
+    else:
+        sys.exit(0 if compare(reference_engine) else 1)
@@ -0,0 +1,401 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+"""
+FixOurFood food supply model
+
+Food item information, year ranges and the routines which turn FAOSTAT food
+supply and population data into per item emission and nutrient arrays, and
+rescale them according to the selected dietary interventions.
+
+These are kept apart from the tkinter dashboard so they can be imported
+without opening a window, e.g. by the multi-country pipeline in
+multi_country.py, which runs them on worker processes.
+
+"""
+
+# load the food item data files for these codes
+fii = pd.read_csv('data/food/food_item_info.csv', sep=':')
+len_items = len(fii)
+len_groups = len(np.unique(fii['group']))
+
+index_label = np.unique(fii['group'], return_index=True)[1]
+group_names = [fii['group'][index] for index in sorted(index_label)]
+
+index_id = np.unique(fii['group_id'], return_index=True)[1]
+group_ids = [fii['group_id'][index] for index in sorted(index_id)]
+
+
+FAOSTAT_years = np.arange(1961, 2020)
+FAOSTAT_projected_years = np.arange(2020, 2101)
+log_length = 25
+
+FAOSTAT_years_all = np.concatenate([FAOSTAT_years, FAOSTAT_projected_years])
+
+# Environmental impact indicators from Poore & Nemecek (2018), "Results - Retail Weight" sheet.
+# Mean values per kg of retail weight, in the units below once multiplied by the
+# yearly food supply in kg and divided by 1e12:
+
+# GHG emissions             Gt CO2e         (kg CO2e / kg)
+# Land use                  million km2     (m2 / kg)
+# Freshwater withdrawals    km3             (L / kg)
+# Eutrophying emissions     Mt PO4 eq       (g PO4 eq / kg)
+# Acidifying emissions      Mt SO2 eq       (g SO2 eq / kg)
+
+impact_names = ['GHG emissions', 'Land use', 'Freshwater withdrawals', 'Eutrophying emissions', 'Acidifying emissions']
+impact_units = ['Gt $CO_2e$', r'million $km^2$', r'$km^3$', r'Mt $PO_4$ eq', r'Mt $SO_2$ eq']
+impact_columns = ['Mean.1', 'Mean', 'Mean.5', 'Mean.4', 'Mean.3']
+
+impact_datafile = 'data/food/aaq0216_datas2.xls'
+impact_cachefile = 'data/food/impact_intensity.npz'
+
+# Poore & Nemecek product matched to each FAO item, following the matches
+# described in Reading_Poore_Nemecek_2018_data.ipynb.
+# GHG emissions always use the mean_emissions column of food_item_info.csv,
+# which includes the processing corrections and literature averages from the notebook.
+# Other indicators use the matched product values. Byproducts like offals, animal
+# fats and fish oils, which the notebook gives zero GHG emissions, take the other
+# indicators of the product they come from, and items without a product in the
+# dataset use the closest one, e.g. tea uses coffee.
+pn18_products = {
+    'Bovine Meat':'Bovine Meat (beef herd)',
+    'Mutton & Goat Meat':'Lamb & Mutton',
+    'Pigmeat':'Pig Meat',
+    'Poultry Meat':'Poultry Meat',
+    'Meat, Other':'Pig Meat',
+    'Offals, Edible':'Pig Meat',
+    'Eggs':'Eggs',
+    'Butter, Ghee':'Milk',
+    'Cream':'Milk',
+    'Milk - Excluding Butter':'Milk',
+    'Wheat and products':'Wheat & Rye (Bread)',
+    'Barley and products':'Barley (Beer)',
+    'Maize and products':'Maize (Meal)',
+    'Rye and products':'Wheat & Rye (Bread)',
+    'Oats':'Oatmeal',
+    'Cereals, Other':'Oatmeal',
+    'Potatoes and products':'Potatoes',
+    'Roots, Other':'Root Vegetables',
+    'Yams':'Cassava',
+    'Rice and Products':'Rice',
+    'Beans':'Other Pulses',
+    'Peas':'Peas',
+    'Pulses, Other and products':'Other Pulses',
+    'Soyabeans':'Other Pulses',
+    'Sweeteners, Other':'Cane Sugar',
+    'Rape and Mustardseed':'Rapeseed Oil',
+    'Oilcrops, Other':'Rapeseed Oil',
+    'Soyabean Oil':'Soybean Oil',
+    'Groundnut Oil':'Soybean Oil',
+    'Sunflowerseed Oil':'Sunflower Oil',
+    'Rape and Mustard Oil':'Rapeseed Oil',
+    'Palmkernel Oil':'Palm Oil',
+    'Palm Oil':'Palm Oil',
+    'Coconut Oil':'Palm Oil',
+    'Sesameseed Oil':'Rapeseed Oil',
+    'Olive Oil':'Olive Oil',
+    'Maize Germ Oil':'Rapeseed Oil',
+    'Oilcrops Oil, Other':'Rapeseed Oil',
+    'Honey':'Beet Sugar',
+    'Nuts and products':'Nuts',
+    'Groundnuts (Shelled Eq)':'Groundnuts',
+    'Coconuts - Incl Copra':'Nuts',
+    'Sesame seed':'Rapeseed Oil',
+    'Aquatic Plants':'Brassicas',
+    'Olives (including preserved)':'Other Fruit',
+    'Tomatoes and products':'Tomatoes',
+    'Onions':'Onions & Leeks',
+    'Oranges, Mandarines':'Citrus Fruit',
+    'Lemons, Limes and products':'Citrus Fruit',
+    'Grapefruit and products':'Citrus Fruit',
+    'Citrus, Other':'Citrus Fruit',
+    'Bananas':'Bananas',
+    'Plantains':'Bananas',
+    'Apples and products':'Apples',
+    'Pineapples and products':'Other Fruit',
+    'Dates':'Other Fruit',
+    'Grapes and products (excl wine)':'Berries & Grapes',
+    'Pimento':'Other Vegetables',
+    'Coffee and products':'Coffee',
+    'Cocoa Beans and products':'Dark Chocolate',
+    'Tea (including mate)':'Coffee',
+    'Pepper':'Rapeseed Oil',
+    'Cloves':'Nuts',
+    'Spices, Other':'Rapeseed Oil',
+    'Wine':'Wine',
+    'Beer':'Barley (Beer)',
+    'Beverages, Fermented':'Barley (Beer)',
+    'Beverages, Alcoholic':'Wine',
+    'Infant food':'Milk',
+    'Fats, Animals, Raw':'Pig Meat',
+    'Freshwater Fish':'Fish (farmed)',
+    'Demersal Fish':'Fish (farmed)',
+    'Pelagic Fish':'Fish (farmed)',
+    'Marine Fish, Other':'Fish (farmed)',
+    'Crustaceans':'Crustaceans (farmed)',
+    'Cephalopods':'Crustaceans (farmed)',
+    'Molluscs, Other':'Crustaceans (farmed)',
+    'Aquatic Animals, Others':'Fish (farmed)',
+    'Fish, Body Oil':'Fish (farmed)',
+    'Fish, Liver Oil':'Fish (farmed)',
+    'Cottonseed Oil':'Soybean Oil',
+}
+
+def _impact_source_hash():
+    # Hash of the Poore & Nemecek file and of the product and column matching
+    sha = hashlib.sha256()
+    with open(impact_datafile, 'rb') as f:
+        sha.update(f.read())
+    sha.update(repr(sorted(pn18_products.items())).encode())
+    sha.update(repr(impact_columns).encode())
+    return sha.hexdigest()
+
+def impact_intensity(rebuild=False):
+    """
+    Returns the (indicator, item) intensity table for the impact_names indicators
+    and the food_item_info.csv items.
+    The table is read from the impact_cachefile numpy file, and only rebuilt from
+    the Poore & Nemecek Excel file if missing, outdated or if rebuild is True.
+    GHG emissions are always taken from the current food_item_info.csv.
+    """
+    source = _impact_source_hash()
+    intensity = None
+    if not rebuild:
+        try:
+            with np.load(impact_cachefile) as cache:
+                if (np.array_equal(cache['codes'], fii['code']) and list(cache['names']) == impact_names
+                        and str(cache['source']) == source):
+                    intensity = cache['intensity']
+        except Exception:
+            # Missing, truncated or old format caches are rebuilt
+            intensity = None
+
+    if intensity is None:
+        data = pd.read_excel(impact_datafile, sheet_name='Results - Retail Weight', header=2, nrows=43)
+        data = data.set_index('Product')
+
+        intensity = np.zeros((len(impact_names), len_items))
+        for i, name in enumerate(fii['name']):
+            if name in pn18_products:
+                intensity[:, i] = data.loc[pn18_products[name], impact_columns]
+
+        # Written to a temporary file first, so an interrupted write never leaves a corrupted cache
+        tmp_file = impact_cachefile + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, intensity=intensity, codes=fii['code'], names=impact_names, source=source)
+        os.replace(tmp_file, impact_cachefile)
+
+    intensity[0] = fii['mean_emissions']
+    return intensity
+
+# Build per item arrays for a given region
+
+# food_data     FAOSTAT food supply data frame, as written by Reading_FAOSTAT_data.ipynb
+# population    estimated population for the 1961-2019 year range
+# projected     projected population for the 2020-2100 year range
+# intensity     Impact intensity per item, either a single indicator with shape (item)
+#               or several indicators with shape (indicator, item) as returned by impact_intensity.
+#               Defaults to the GHGE intensity [kg CO2e / kg] from food_item_info.csv
+
+def food_arrays(food_data, population, projected, intensity=None):
+
+    if intensity is None:
+        intensity = fii['mean_emissions']
+
+    supply = np.zeros((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))
+    weight = np.zeros_like(supply)
+    energy = np.zeros_like(supply)
+    proteins = np.zeros_like(supply)
+
+    # Last food supply estimated value is used as pivot value
+    # to scale as a function of projected population
+    population_pivot = population[-1]
+    population_ratio_projected = projected / population_pivot
+
+    # First half of the array is filled with estimations from FAOSTAT food supply data
+    # Second half of the array is filled with scaled values according to population growth from pivot point
+
+    for i, code in enumerate(fii['code']):
+        # Yearly food supply of the whole population [kg / year]
+        supply[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 10004)]['Value'] * 365.25 * population
+        supply[i,len(FAOSTAT_years):] = population_ratio_projected * supply[i,len(FAOSTAT_years)-1]
+
+        weight[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 10004)]['Value']
+        weight[i,len(FAOSTAT_years):] = weight[i,len(FAOSTAT_years)-1]
+
+        energy[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 664)]['Value']
+        energy[i,len(FAOSTAT_years):] = energy[i,len(FAOSTAT_years)-1]
+
+        proteins[i,:len(FAOSTAT_years)] = food_data[(food_data['Item Code'] == code) & (food_data['Element Code'] == 674)]['Value']
+        proteins[i,len(FAOSTAT_years):] = proteins[i,len(FAOSTAT_years)-1]
+
+    # All indicators for every item and year from a single
+    # (indicator, item) x (item, year) product
+    impacts = np.asarray(intensity, dtype=float)[..., None] * supply / 1e12
+
+    return impacts, weight, energy, proteins
+
+# Function to scale food item consumption to keep protein intake constant
+
+# ruminant_slider   [0-4]
+# veg_interv        [0,1]
+# meatfree_slider   [0,7] if veg_interv == 1
+# egg_checkbox      [0,1] if veg_interv == 1
+# dairy_checkbox    [0,1] if veg_interv == 1
+# vegetarian_slider [0,4] if veg_interv == 0
+
+def adoption_curve(timescale, length, start, model = 'linear'):
+    """
+    Fraction of the final intervention adopted on each year, and mask of the
+    years after the transition where the intervention is fully adopted.
+    """
+    curve = np.zeros(length)
+    settled = np.zeros(length, dtype=bool)
+    if model == 'linear':
+        curve[start : start + timescale] = np.arange(timescale) / timescale
+        settled[start + timescale:] = True
+    elif model == 'logistic':
+        curve[start : start + log_length] = 1 / (1 + np.exp(-0.5*(log_length + 1 - timescale)*(np.arange(log_length) - timescale / 2)))
+        settled[start + log_length:] = True
+    return curve, settled
+
+# Precomputed adoption curves for every dashboard timescale [0, log_length],
+# starting on the first projected year
+adoption_start = len(FAOSTAT_years)+1
+adoption_curves = {model:np.array([adoption_curve(timescale, len(FAOSTAT_years_all), adoption_start, model)[0] for timescale in range(log_length+1)])
+                   for model in ['linear', 'logistic']}
+adoption_settled = {model:np.array([adoption_curve(timescale, len(FAOSTAT_years_all), adoption_start, model)[1] for timescale in range(log_length+1)])
+                    for model in ['linear', 'logistic']}
+
+def timescale_factor(timescale, final_scale, length, start, model = 'linear'):
+    if length == len(FAOSTAT_years_all) and start == adoption_start and 0 <= timescale <= log_length:
+        curve, settled = adoption_curves[model][timescale], adoption_settled[model][timescale]
+    else:
+        curve, settled = adoption_curve(timescale, length, start, model)
+    mu = 1 - final_scale
+    base = 1 - mu*curve
+    base[settled] = final_scale
+    return base
+
+def scale_food(timescale, nutrient, ruminant, vegetarian_intervention, meatfree, vegetarian, seafood, eggs, dairy, model):
+
+    # First scale down ruminant meat consumption.
+    ruminant_fraction = (4-ruminant)/4
+    if model:
+        adoption = 'logistic'
+    else:
+        adoption = 'linear'
+
+    ruminant_fraction = timescale_factor(timescale, ruminant_fraction, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+    meat_fraction = (7-meatfree)/7
+    meat_fraction = timescale_factor(timescale, meat_fraction, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+
+    total_nutrient_seafood = np.sum(nutrient[fii['group_id'] == 10], axis=0)
+    total_nutrient_eggs = np.sum(nutrient[fii['group_id'] == 2], axis=0)
+    total_nutrient_dairy = np.sum(nutrient[fii['group_id'] == 3], axis=0)
+    total_nutrient_pulses = np.sum(nutrient[fii['group_id'] == 5], axis=0)
+    total_nutrient_nuts = np.sum(nutrient[fii['group_id'] == 7], axis=0)
+    total_nutrient_ruminant = np.sum(nutrient[fii['group_id'] == 0], axis=0)
+    total_nutrient_othermeat = np.sum(nutrient[fii['group_id'] == 1], axis=0)
+    total_nutrient = np.sum(nutrient, axis=0)
+
+    total_nutrient_meat = total_nutrient_ruminant + total_nutrient_othermeat
+    total_nutrient_nomeat = total_nutrient - total_nutrient_meat
+    total_nutrient_scaled_ruminant =  total_nutrient_ruminant * ruminant_fraction
+
+    othermeat_fraction = meat_fraction * (total_nutrient_meat - total_nutrient_scaled_ruminant) / total_nutrient_othermeat
+    # Without other meat supply the displaced ruminant nutrient can not be moved into
+    # other meat, and is redistributed over the non meat groups instead
+    othermeat_fraction = np.where(total_nutrient_othermeat > 0, othermeat_fraction, 1)
+
+    # Meat Free Days
+    if vegetarian_intervention == 0:
+        total_nutrient_scaled_othermeat =  total_nutrient_othermeat * othermeat_fraction
+        total_nutrient_scaled_meat = meat_fraction * (total_nutrient_scaled_othermeat + total_nutrient_scaled_ruminant)
+        total_nutrient_minus_scaled_meat = total_nutrient - total_nutrient_scaled_meat
+        if not seafood:
+            total_nutrient_minus_scaled_meat += (1-meat_fraction) * total_nutrient_seafood
+        if not eggs:
+            total_nutrient_minus_scaled_meat += (1-meat_fraction) * total_nutrient_eggs
+        if not dairy:
+            total_nutrient_minus_scaled_meat += (1-meat_fraction) * total_nutrient_dairy
+
+        nomeat_fraction = total_nutrient_minus_scaled_meat / total_nutrient_nomeat
+
+        ruminant_fraction *= meat_fraction
+        total_nutrient_meat *= meat_fraction
+        food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years))) * nomeat_fraction
+
+        if not seafood:
+            food_scale[fii['group_id'] == 10] *= meat_fraction
+        if not eggs:
+            food_scale[fii['group_id'] == 2] *= meat_fraction
+        if not dairy:
+            food_scale[fii['group_id'] == 3] *= meat_fraction
+
+        food_scale[fii['group_id'] == 0] = ruminant_fraction
+        food_scale[fii['group_id'] == 1] = othermeat_fraction
+
+    # Type of vegetarian diet
+    elif vegetarian_intervention == 1:
+        one_minus_logistic = 1 - timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+        if vegetarian == 0:
+            total_nutrient_scaled_othermeat =  total_nutrient_othermeat * othermeat_fraction
+            total_nutrient_scaled_meat = meat_fraction * (total_nutrient_scaled_othermeat + total_nutrient_scaled_ruminant)
+            total_nutrient_minus_scaled_meat = total_nutrient - total_nutrient_scaled_meat
+            nomeat_fraction = total_nutrient_minus_scaled_meat / total_nutrient_nomeat
+            ruminant_fraction *= meat_fraction
+            total_nutrient_meat *= meat_fraction
+            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years))) * nomeat_fraction
+
+            food_scale[fii['group_id'] == 0] = ruminant_fraction
+            food_scale[fii['group_id'] == 1] = othermeat_fraction
+
+        elif vegetarian == 1:
+            total_vegetarian_nutrient = total_nutrient - total_nutrient_ruminant*one_minus_logistic
+            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
+            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
+            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+
+        elif vegetarian == 2:
+            total_vegetarian_nutrient = total_nutrient - (total_nutrient_ruminant + total_nutrient_othermeat)*one_minus_logistic
+            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
+            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
+            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 1] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 1] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+
+        elif vegetarian == 3:
+            total_vegetarian_nutrient = total_nutrient - (total_nutrient_ruminant + total_nutrient_othermeat + total_nutrient_seafood)*one_minus_logistic
+            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
+            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
+            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 1] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 10] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 1] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 10] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+
+        elif vegetarian == 4:
+            total_vegetarian_nutrient = total_nutrient - (total_nutrient_ruminant + total_nutrient_othermeat + total_nutrient_seafood + total_nutrient_eggs + total_nutrient_dairy)*one_minus_logistic
+            vegetarian_fraction = total_nutrient / total_vegetarian_nutrient
+            food_scale = np.ones((len_items, len(FAOSTAT_years) + len(FAOSTAT_projected_years)))*vegetarian_fraction
+            # food_scale[fii['group_id'] == 0] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 1] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 10] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 2] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            # food_scale[fii['group_id'] == 3] = np.zeros(len(FAOSTAT_years) + len(FAOSTAT_projected_years))
+            food_scale[fii['group_id'] == 0] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 1] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 10] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 2] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+            food_scale[fii['group_id'] == 3] = timescale_factor(timescale, 0, len(FAOSTAT_years_all), len(FAOSTAT_years)+1, model = adoption)
+
+    food_scale[:, :len(FAOSTAT_years)] = 1
+    return food_scale
@@ -0,0 +1,202 @@
+import os
+
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool, shared_memory
+
+import fair
+from food_model import *
+
+
+"""
+FixOurFood multi-country model
+
+Runs the dashboard food supply -> emissions -> FAIR chain for a list of
+countries instead of the single hard-wired area used by GUI_test_meat.py,
+and reduces the results into regional and global totals.
+
+Each country is processed independently on a pool of worker processes:
+
+- The impact intensity table returned by impact_intensity is placed once in
+  shared memory and attached read-only by every worker, instead of being
+  pickled with each task.
+- Every worker loads its own country food supply and population files,
+  computes the per item arrays with food_arrays, rescales them with
+  scale_food and runs FAIR on the country emissions.
+
+Regional and global climate responses are obtained by running FAIR on the
+summed emissions of their countries, as FAIR is not linear and temperatures
+can not simply be added. These runs are fanned out over the same pool.
+
+Country data is read from the following files, where {area} is the country
+name used as key, e.g. "UK":
+
+- data/food/food_supply_data_{area}.csv
+    Food supply data with the same format as food_supply_data.csv, written
+    by Reading_FAOSTAT_data.ipynb filtering by the required country
+- data/population/Total_population_UN_median_{area}.npy
+- data/population/Total_population_UN_median_{area}_projected_2020_2100.npy
+    Estimated and projected population arrays written by
+    Reading_UN_population_data.ipynb
+
+"""
+
+food_file = 'data/food/food_supply_data_{area}.csv'
+population_file = 'data/population/Total_population_UN_median_{area}.npy'
+projected_file = 'data/population/Total_population_UN_median_{area}_projected_2020_2100.npy'
+
+# Default scenario, equivalent to the dashboard widgets at startup
+default_scenario = {
+    'timescale':1,
+    'nutrient':'Weight',
+    'ruminant':0,
+    'vegetarian_intervention':0,
+    'meatfree':0,
+    'vegetarian':0,
+    'seafood':True,
+    'eggs':True,
+    'dairy':True,
+    'model':True,
+}
+
+# Read only intensity table, attached by each worker process
+_intensity_shm = None
+_intensity = None
+
+def load_country(area):
+    """
+    Load food supply and population data for a country.
+    Items, elements or years missing from the food supply data are filled with zeros
+    so every country produces arrays with the same shape.
+    """
+    food_data = pd.read_csv(food_file.format(area=area))
+    population = np.load(population_file.format(area=area))
+    projected = np.load(projected_file.format(area=area))
+
+    index = pd.MultiIndex.from_product([fii['code'], [10004, 664, 674], FAOSTAT_years],
+                                       names=['Item Code', 'Element Code', 'Year'])
+    food_data = food_data.set_index(['Item Code', 'Element Code', 'Year'])['Value']
+    food_data = food_data[~food_data.index.duplicated()].reindex(index, fill_value=0)
+
+    return food_data.reset_index(), population, projected
+
+def missing_files(areas):
+    """
+    Returns the country data files needed by areas which do not exist
+    """
+    return [file.format(area=area) for area in areas
+            for file in (food_file, population_file, projected_file)
+            if not os.path.exists(file.format(area=area))]
+
+def _init_worker(name, shape, dtype):
+    global _intensity_shm, _intensity
+    _intensity_shm = shared_memory.SharedMemory(name=name)
+    _intensity = np.ndarray(shape, dtype=dtype, buffer=_intensity_shm.buf)
+    _intensity.flags.writeable = False
+
+def _climate_response(emissions):
+    C, F, T = fair.forward.fair_scm(emissions=emissions, useMultigas=False)
+    return C, F, T
+
+def _run_country(args):
+    area, scenario = args
+    food_data, population, projected = load_country(area)
+    impacts, weight, energy, proteins = food_arrays(food_data, population, projected, _intensity)
+
+    nutrient = {'Weight':weight, 'Energy':energy, 'Proteins':proteins}[scenario['nutrient']]
+    # Countries with no supply for a whole food group can give 0/0 or x/0 scaling
+    # factors, which have no effect on the empty group and are set to 1.
+    # With no other meat supply, scale_food moves the ruminant meat nutrient
+    # displaced by a ruminant reduction into the non meat groups.
+    with np.errstate(invalid='ignore', divide='ignore'):
+        food_scale = scale_food(scenario['timescale'], nutrient, scenario['ruminant'],
+                                scenario['vegetarian_intervention'], scenario['meatfree'],
+                                scenario['vegetarian'], scenario['seafood'], scenario['eggs'],
+                                scenario['dairy'], scenario['model'])
+    food_scale = np.nan_to_num(food_scale, nan=1, posinf=1, neginf=1)
+
+    scaled_impacts = impacts*food_scale
+    C, F, T = _climate_response(np.sum(scaled_impacts[0], axis=0))
+
+    return {
+        'impacts':scaled_impacts,
+        'emissions':scaled_impacts[0],
+        'energy':np.sum(energy*food_scale, axis=0),
+        'proteins':np.sum(proteins*food_scale, axis=0),
+        'population':np.concatenate([population, projected]),
+        'C':C, 'F':F, 'T':T,
+    }
+
+def run_countries(areas, scenario=None, regions=None, processes=None):
+    """
+    Run the scenario for each of the countries in areas.
+
+    regions is an optional dictionary mapping region names to lists of areas.
+    Returns a dictionary with the per country results under "countries",
+    the per region totals under "regions" and the global total under "global".
+    Totals contain the summed per item impacts and emissions, the population weighted
+    per capita energy and protein supply and the FAIR C, F, T arrays.
+    """
+    scenario = dict(default_scenario, **(scenario or {}))
+    regions = regions or {}
+
+    # Check the areas, regions and country data before starting the pool
+    if not areas:
+        raise ValueError('No areas given')
+    for region, members in regions.items():
+        if not members:
+            raise ValueError(f'Region {region} has no areas')
+        unknown = [area for area in members if area not in areas]
+        if unknown:
+            raise ValueError(f'Region {region} contains areas not in areas: {", ".join(unknown)}')
+
+    missing = missing_files(areas)
+    if missing:
+        raise FileNotFoundError('Missing country data files:\n' + '\n'.join(missing))
+
+    intensity = np.ascontiguousarray(impact_intensity(), dtype=float)
+    shm = shared_memory.SharedMemory(create=True, size=intensity.nbytes)
+    try:
+        np.ndarray(intensity.shape, dtype=intensity.dtype, buffer=shm.buf)[:] = intensity
+
+        with Pool(processes, initializer=_init_worker,
+                  initargs=(shm.name, intensity.shape, intensity.dtype)) as pool:
+
+            results = pool.map(_run_country, [(area, scenario) for area in areas])
+            countries = dict(zip(areas, results))
+
+            # Reduce country results into regional and global totals
+            totals = {region:_reduce([countries[area] for area in members]) for region, members in regions.items()}
+            totals[None] = _reduce(results)
+
+            responses = pool.map(_climate_response, [np.sum(total['emissions'], axis=0) for total in totals.values()])
+            for total, (C, F, T) in zip(totals.values(), responses):
+                total['C'], total['F'], total['T'] = C, F, T
+
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return {'countries':countries, 'global':totals.pop(None), 'regions':totals}
+
+def _reduce(results):
+    population = np.sum([result['population'] for result in results], axis=0)
+    impacts = np.sum([result['impacts'] for result in results], axis=0)
+    return {
+        'impacts':impacts,
+        'emissions':impacts[0],
+        'energy':np.sum([result['energy']*result['population'] for result in results], axis=0) / population,
+        'proteins':np.sum([result['proteins']*result['population'] for result in results], axis=0) / population,
+        'population':population,
+    }
+
+if __name__ == '__main__':
+    import sys
+    areas = sys.argv[1:]
+    if not areas:
+        print('Usage: python multi_country.py area [area ...]')
+        sys.exit(1)
+    result = run_countries(areas)
+    for area in areas:
+        print(area, np.sum(result['countries'][area]['emissions'], axis=0)[-1], result['countries'][area]['T'][-1])
+    print('Global', np.sum(result['global']['emissions'], axis=0)[-1], result['global']['T'][-1])
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import pickle
+
+
+"""
+Dashboard session persistence
+
+Saves the dashboard control state and warm caches (model arrays, scenario
+results and FAIR outputs) to a local file on exit, so the next launch can
+draw its first frame from cache without recomputing anything.
+
+Sessions are versioned with a hash of the input data files and model code,
+so a session is silently discarded whenever any of them changes.
+
+"""
+
+# Increase when the contents of the saved session change
+session_format = 1
+
+def input_hash(files):
+    """
+    SHA-256 hash of the contents of files, together with the session format.
+    """
+    sha = hashlib.sha256(str(session_format).encode())
+    for file in files:
+        with open(file, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+def load_session(path, version):
+    """
+    Returns the session dictionary stored in path, or None if the file
+    is missing, unreadable or was saved for a different version.
+    """
+    try:
+        with open(path, 'rb') as f:
+            session = pickle.load(f)
+    except Exception:
+        # Any unreadable session is discarded and the dashboard starts from scratch
+        return None
+
+    if not isinstance(session, dict) or session.get('version') != version:
+        return None
+
+    return session
+
+def save_session(path, version, **contents):
+    """
+    Stores contents in path, tagged with version.
+    The file is written to a temporary file first and then moved into place,
+    so an interrupted save never leaves a corrupted session behind.
+    """
+    contents['version'] = version
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)